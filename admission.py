@@ -0,0 +1,291 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from shared_state import deployment_path, pid_alive, read_state, update_state
+
+try:
+    import fcntl
+except ImportError:  # Windows dev server: single process, fall back to in-process locks
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Limits for one route:
+# concurrency - requests allowed to run at once across all workers
+# queue       - requests allowed to wait for a free slot; any more are shed straight away
+# deadline    - seconds a queued request may wait before it is shed
+Limit = namedtuple('Limit', ['concurrency', 'queue', 'deadline'])
+
+# Limits for one priority class, counting queued and running requests:
+# budget      - requests admitted across all workers
+# per_process - requests admitted within one worker process, so each worker keeps threads free
+Pool = namedtuple('Pool', ['budget', 'per_process'])
+
+POLL_SECONDS = 0.05      # how often a queued request re-checks for a free slot
+
+SHED_CLASS_FULL = 'class_full'
+SHED_QUEUE_FULL = 'queue_full'
+SHED_DEADLINE = 'deadline'
+UPSTREAM_ERROR = 'upstream_error'
+
+
+def _empty_state():
+    return {'counters': {}, 'gauges': {}}
+
+
+def _prune_dead(state):
+    """Drops the gauges of workers that are no longer running, e.g. killed on a timeout."""
+    for pid in list(state['gauges']):
+        if not pid_alive(int(pid)):
+            del state['gauges'][pid]
+
+
+class Ticket:
+    """Slots held by an admitted request; released exactly once."""
+
+    def __init__(self, controller, route, handles, process_slot=None):
+        self._controller = controller
+        self._route = route
+        self._handles = handles
+        self._process_slot = process_slot
+
+    def release(self):
+        """Frees the slots so the next queued request can run."""
+        handles, self._handles = self._handles, []
+        process_slot, self._process_slot = self._process_slot, None
+        for handle in handles:
+            self._controller._unlock(handle)
+        if process_slot is not None:
+            process_slot.release()
+        if handles and self._route is not None:
+            self._controller._record(self._route, in_flight=-1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Admission control for slow routes, shared by all gunicorn workers.
+
+    Each route belongs to a priority class. Routes that are not registered (static pages, pure model
+    inference) are never limited. A registered request first takes a slot of its class pool, both in
+    its own worker process and across all workers, and keeps it while it is queued and while it runs.
+    The pool therefore caps how many threads of each worker the class can occupy; requests arriving
+    when it is full are shed at once. The request then needs one of its route's slots, waiting in a
+    bounded queue until its deadline if none is free. New arrivals join the queue whenever requests
+    are already waiting, though the waiters themselves are not served in strict FIFO order.
+
+    Requests failing with one of 'upstream_errors' get the same degraded response as shed requests.
+
+    Slots and queue places are lock files in a per-deployment directory, taken with non-blocking flock
+    calls. The kernel releases a lock when its holder dies, so a crashed worker never leaks a slot.
+    Admitted and shed counters, and the in-flight and queued gauges of each worker, are kept in a small
+    JSON state file in the same directory so they can be read from any worker.
+    """
+
+    def __init__(self, classes, routes, state_dir=None, upstream_errors=()):
+        """
+        Args:
+        classes (dict): Pool of each priority class, keyed by class name.
+        routes (dict): (class name, Limit) of each limited route, keyed by route name.
+        state_dir (str): Directory for lock and state files. Defaults to one keyed by the gunicorn master pid.
+        upstream_errors (tuple): Exception types of a failing upstream service, answered with the degraded response.
+        """
+        self.classes = classes
+        self.routes = routes
+        self.upstream_errors = tuple(upstream_errors)
+        self._process_slots = {name: threading.BoundedSemaphore(pool.per_process) for name, pool in classes.items()}
+        if state_dir is None:
+            state_dir = deployment_path('admission', os.getppid())
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, 'state.json')
+        self._local_locks = {}
+        self._guard = threading.Lock()
+
+    # Lock primitives
+
+    def _try_lock(self, name):
+        """Takes the named lock without blocking; returns a handle or None if it is held elsewhere."""
+        if fcntl is None:
+            with self._guard:
+                lock = self._local_locks.setdefault(name, threading.Lock())
+            return lock if lock.acquire(blocking=False) else None
+        handle = open(os.path.join(self.state_dir, name + '.lock'), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+
+    def _unlock(self, handle):
+        if fcntl is None:
+            handle.release()
+        else:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def _try_any(self, prefix, count):
+        """Takes the first free lock out of 'count' numbered locks."""
+        for i in range(count):
+            handle = self._try_lock('{}.{}'.format(prefix, i))
+            if handle is not None:
+                return handle
+        return None
+
+    # Shared state
+
+    def _record(self, route, outcome=None, in_flight=0, queued=0):
+        """Bumps a counter and/or this worker's gauges for 'route' in the shared state."""
+        def update(state):
+            _prune_dead(state)
+            if outcome is not None:
+                route_counters = state['counters'].setdefault(route, {})
+                route_counters[outcome] = route_counters.get(outcome, 0) + 1
+            if in_flight or queued:
+                gauges = state['gauges'].setdefault(str(os.getpid()), {}).setdefault(route, {})
+                gauges['in_flight'] = max(gauges.get('in_flight', 0) + in_flight, 0)
+                gauges['queued'] = max(gauges.get('queued', 0) + queued, 0)
+
+        try:
+            update_state(self.state_path, update, _empty_state)
+        except OSError:
+            logger.exception("Could not update admission state at %s", self.state_path)
+
+    def _queued(self, route):
+        """Returns how many requests are waiting for a slot of 'route' in live workers."""
+        state = read_state(self.state_path, _empty_state)
+        return sum(worker.get(route, {}).get('queued', 0)
+                   for pid, worker in state['gauges'].items() if pid_alive(int(pid)))
+
+    def upstream_failed(self, route, error):
+        """Records a request on 'route' that failed because of the upstream service."""
+        logger.warning("Upstream failure on %s: %r", route, error)
+        self._record(route, UPSTREAM_ERROR)
+
+    # Admission
+
+    def acquire(self, route):
+        """
+        Asks for permission to run a request on 'route'.
+
+        Args:
+        route (str): Route name, as registered in 'routes'. Unregistered routes are always admitted.
+
+        Returns:
+        Ticket: A ticket to release once the request is done, or None if the request was shed.
+        """
+        if route not in self.routes:
+            return Ticket(self, None, [])
+
+        class_name, limit = self.routes[route]
+        process_slot = self._process_slots[class_name]
+        if not process_slot.acquire(blocking=False):
+            self._record(route, SHED_CLASS_FULL)
+            return None
+        class_slot = self._try_any('class.{}.slot'.format(class_name), self.classes[class_name].budget)
+        if class_slot is None:
+            process_slot.release()
+            self._record(route, SHED_CLASS_FULL)
+            return None
+
+        route_prefix = 'route.{}.slot'.format(route)
+        route_slot = None
+        if not limit.queue or not self._queued(route):
+            route_slot = self._try_any(route_prefix, limit.concurrency)
+        if route_slot is None:
+            queue_place = self._try_any('route.{}.queue'.format(route), limit.queue)
+            if queue_place is None:
+                self._unlock(class_slot)
+                process_slot.release()
+                self._record(route, SHED_QUEUE_FULL)
+                return None
+            self._record(route, queued=1)
+            try:
+                give_up = time.monotonic() + limit.deadline
+                while route_slot is None and time.monotonic() < give_up:
+                    time.sleep(POLL_SECONDS)
+                    route_slot = self._try_any(route_prefix, limit.concurrency)
+            finally:
+                self._unlock(queue_place)
+            if route_slot is None:
+                self._unlock(class_slot)
+                process_slot.release()
+                self._record(route, SHED_DEADLINE, queued=-1)
+                return None
+            self._record(route, 'admitted', in_flight=1, queued=-1)
+        else:
+            self._record(route, 'admitted', in_flight=1)
+        return Ticket(self, route, [class_slot, route_slot], process_slot)
+
+    def limit(self, route, degraded):
+        """
+        Decorator running a view under admission control.
+
+        Args:
+        route (str): Route name, as registered in 'routes'.
+        degraded (callable): Called instead of the view when the request is shed or the upstream fails.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                ticket = self.acquire(route)
+                if ticket is None:
+                    logger.warning("Shedding request to %s", route)
+                    return degraded()
+                try:
+                    with ticket:
+                        return view(*args, **kwargs)
+                except self.upstream_errors as error:
+                    self.upstream_failed(route, error)
+                    return degraded()
+            return wrapper
+        return decorator
+
+    def stats(self):
+        """
+        Returns current load and shed counts of every limited route and class.
+
+        Returns:
+        dict: In-flight and queued requests plus admitted/shed counters per route, and usage per class.
+        """
+        state = read_state(self.state_path, _empty_state)
+        _prune_dead(state)
+        routes = {}
+        for route, (class_name, limit) in self.routes.items():
+            route_counters = state['counters'].get(route, {})
+            gauges = [worker.get(route, {}) for worker in state['gauges'].values()]
+            routes[route] = {
+                'class': class_name,
+                'concurrency': limit.concurrency,
+                'queue_limit': limit.queue,
+                'deadline': limit.deadline,
+                'in_flight': sum(g.get('in_flight', 0) for g in gauges),
+                'queued': sum(g.get('queued', 0) for g in gauges),
+                'admitted': route_counters.get('admitted', 0),
+                'shed_class_full': route_counters.get(SHED_CLASS_FULL, 0),
+                'shed_queue_full': route_counters.get(SHED_QUEUE_FULL, 0),
+                'shed_deadline': route_counters.get(SHED_DEADLINE, 0),
+                'upstream_errors': route_counters.get(UPSTREAM_ERROR, 0),
+            }
+        classes = {
+            class_name: {
+                'budget': pool.budget,
+                'per_process': pool.per_process,
+                'in_flight': sum(r['in_flight'] for r in routes.values() if r['class'] == class_name),
+                'queued': sum(r['queued'] for r in routes.values() if r['class'] == class_name),
+            }
+            for class_name, pool in self.classes.items()
+        }
+        return {'classes': classes, 'routes': routes}
@@ -8,6 +8,10 @@ import json
 import time
 import joblib
 from openai import OpenAI
+from drift_monitor import DriftMonitor, build_baseline
+from shared_state import deployment_path
+from admission import AdmissionController, Limit, Pool
+import gunicorn_config
 
 
 
@@ -20,7 +24,8 @@ app.secret_key = 'ab12secretkey'
 
 
 # Instantiate the OpenAI client with API key from environment variable
-client = OpenAI(api_key= 'RETRACTED FOR UPLOADING PURPOSES')
+# Calls time out after 20 seconds without retrying, so a slow API holds admission slots for at most 20 seconds
+client = OpenAI(api_key= 'RETRACTED FOR UPLOADING PURPOSES', timeout=20.0, max_retries=0)
 
 
 # Load the predictive model from a file
@@ -28,6 +33,48 @@ loaded_model = joblib.load('random_forest_model.pkl')
 print("Model loaded successfully.")
 
 
+# Monitoring state is shared by the processes of one deployment, owned by the gunicorn master
+# (the parent of the workers) or, when run directly with the dev server, by this process
+DEPLOYMENT_PID = os.getpid() if __name__ == '__main__' else os.getppid()
+
+
+# Build the training-data baseline and the monitor that tracks drift of scored applications against it
+drift_monitor = DriftMonitor(build_baseline('loan_approval_dataset.csv'),
+                             state_path=deployment_path('drift.json', DEPLOYMENT_PID))
+
+
+# Threads of each gunicorn worker reserved for static pages and model inference, which are never
+# limited. The routes that wait on OpenAI share the 'llm' pool made of the remaining threads of every
+# worker, counting queued and running requests. Worker and thread counts come from gunicorn_config.py.
+RESERVED_THREADS = 4
+LLM_THREADS_PER_WORKER = max(gunicorn_config.threads - RESERVED_THREADS, 1)
+LLM_BUDGET = gunicorn_config.workers * LLM_THREADS_PER_WORKER
+
+# No route may hold more than half of the pool, so one busy route cannot shed all the others
+ROUTE_SHARE = max(LLM_BUDGET // 2, 2)
+LLM_ROUTE = ('llm', Limit(concurrency=ROUTE_SHARE // 2, queue=ROUTE_SHARE - ROUTE_SHARE // 2, deadline=3))
+
+# OpenAI failures answered with the degraded response rather than an error page
+UPSTREAM_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)
+
+# Admission control for the routes that wait on OpenAI
+admission = AdmissionController(
+    classes={'llm': Pool(budget=LLM_BUDGET, per_process=LLM_THREADS_PER_WORKER)},
+    routes={
+        'chat_predict': LLM_ROUTE,
+        'business_idea': LLM_ROUTE,
+        'financial_advice': LLM_ROUTE,
+        'further_predict_chat': LLM_ROUTE,
+        'further_business_chat': LLM_ROUTE,
+        'further_finance_chat': LLM_ROUTE,
+    },
+    state_dir=deployment_path('admission', DEPLOYMENT_PID),
+    upstream_errors=UPSTREAM_ERRORS)
+
+# Message shown when a request is shed under load
+BUSY_MESSAGE = "Our assistant is very busy right now. Please try again in a minute."
+
+
 # Define the column names for the model input
 columns = ['no_of_dependents', 'education', 'self_employed', 'income_annum',
            'loan_amount', 'loan_term', 'cibil_score', 'residential_assets_value',
@@ -303,6 +350,46 @@ def get_financial_advice(country, country_interest, description, capital_loan, a
 
 
 
+def busy_page(template, chat):
+    """
+    Renders a chat page in its degraded form when the request was shed by admission control.
+
+    The previous conversation of this chat is cleared from the session, so follow-up questions are not
+    answered in the context of an older, unrelated request.
+
+    Args:
+    template (str): The chat template the route would normally render.
+    chat (str): The chat whose session keys to clear, e.g. 'business' for 'bot_business_response'.
+
+    Returns:
+    tuple: The rendered template with a 503 status and a Retry-After header.
+    """
+    session.pop("bot_{}_response".format(chat), None)
+    session.pop("bot_{}_prompt".format(chat), None)
+
+    return render_template(template, name=session.get("name", None), country=session.get("country", None),
+                           busy=True, busy_message=BUSY_MESSAGE), 503, {'Retry-After': '30'}
+
+
+
+def busy_chat():
+    """
+    Returns a friendly chat reply when a follow-up question was shed by admission control.
+
+    The reply uses a 200 status so the chat widget shows it like any other answer.
+
+    Returns:
+    jsonify: A JSON response containing the busy message.
+    """
+    return jsonify({"response": BUSY_MESSAGE, "degraded": True})
+
+
+
+
+
+
+
+
 model= None
 
 
@@ -456,15 +543,26 @@ def chat_predict():
     arr = pd.DataFrame((np.array([[depend, education, employment, income, loan_amount, loan_term, score, resident, commercial, luxury, bank]])), columns=columns)
     pred = int(loaded_model.predict(arr)[0])
 
+    # Record the application for input drift monitoring
+    drift_monitor.update(arr.iloc[0].to_dict())
+
     # Retrieve user's country and name from session
     country = session.get("country", None)
     name = session.get("name", None)
 
-    # Generate a prompt message and get response
-    bot_predict_prompt, bot_predict_response = get_predict_message(country)
+    # Generate a prompt message and get response, skipping the chatbot under load or when OpenAI fails
+    # so the prediction still gets through
+    bot_predict_prompt, bot_predict_response = "", []
+    ticket = admission.acquire('chat_predict')
+    if ticket is not None:
+        try:
+            with ticket:
+                predict_prompt, predict_response = get_predict_message(country)
 
-    # Convert the response to JSON format if needed
-    bot_predict_response = json.loads(bot_predict_response)
+            # Convert the response to JSON format if needed
+            bot_predict_prompt, bot_predict_response = predict_prompt, json.loads(predict_response)
+        except (openai.OpenAIError, ValueError) as error:
+            admission.upstream_failed('chat_predict', error)
 
     # Store prediction and responses in session
     session["pred"] = pred
@@ -479,6 +577,7 @@ def chat_predict():
 
 
 @app.route('/further_predict_chat', methods=["GET", "POST"])
+@admission.limit('further_predict_chat', degraded=busy_chat)
 def further_predict_chat():
     """
     Route to handle further prediction interactions in a chat interface.
@@ -518,6 +617,7 @@ def further_predict_chat():
 
 
 @app.route('/business_idea', methods=["GET", "POST"])
+@admission.limit('business_idea', degraded=lambda: busy_page('chat_business.html', 'business'))
 def business_idea():
     """
     Route to handle business idea suggestions based on user inputs.
@@ -566,6 +666,7 @@ def business_idea():
 
 
 @app.route('/further_business_chat', methods=["GET", "POST"])
+@admission.limit('further_business_chat', degraded=busy_chat)
 def further_business_chat():
     """
     Route to handle further interactions in the business chat interface.
@@ -602,6 +703,7 @@ def further_business_chat():
 
 
 @app.route('/financial_advice', methods=["GET", "POST"])
+@admission.limit('financial_advice', degraded=lambda: busy_page('chat_finance.html', 'finance'))
 def financial_advice():
     """
     Route to handle financial advice requests based on user inputs.
@@ -653,6 +755,7 @@ def financial_advice():
 
 
 @app.route('/further_finance_chat', methods=["GET", "POST"])
+@admission.limit('further_finance_chat', degraded=busy_chat)
 def further_finance_chat():
     """
     Route to handle follow-up interactions in the financial chat interface.
@@ -687,5 +790,37 @@ def further_finance_chat():
 
 
 
+
+@app.route('/drift', methods=["GET"])
+def drift():
+    """
+    Route exposing input drift scores for monitoring.
+
+    This route merges the drift sketches of all workers and compares them with the training-data
+    baseline. The 'alert' flag is set once enough requests have been scored and at least one feature
+    has a PSI above the threshold.
+
+    Returns:
+    jsonify: A JSON report with the sample count, alert flag and per-feature PSI and KS scores.
+    """
+    return jsonify(drift_monitor.report())
+
+
+
+@app.route('/admission', methods=["GET"])
+def admission_stats():
+    """
+    Route exposing admission control state for monitoring.
+
+    This route reports, for every limited route, how many requests are running and queued across all
+    workers, and how many have been admitted or shed since the deployment started.
+
+    Returns:
+    jsonify: A JSON report of in-flight, queued, admitted and shed counts per route and priority class.
+    """
+    return jsonify(admission.stats())
+
+
+
 if __name__ == '__main__':
     app.run(debug= True, use_reloader=False)
@@ -0,0 +1,263 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from shared_state import deployment_path, read_state, update_state
+
+
+logger = logging.getLogger(__name__)
+
+
+# Features as they are named in the '/chat_predict' form and in 'loan_approval_dataset.csv'
+NUMERIC_FEATURES = ['depend', 'income', 'loan_amount', 'loan_term', 'score',
+                    'resident', 'commercial', 'luxury', 'bank']
+CATEGORICAL_FEATURES = ['education', 'employment']
+
+# The form posts coded values, the dataset stores labels; map labels onto the form codes
+CATEGORY_CODES = {
+    'education': {'Graduate': '0', 'Not Graduate': '1'},
+    'employment': {'Yes': '1', 'No': '0'},
+}
+
+OTHER = 'other'
+INVALID = 'invalid'
+
+NUM_BINS = 10            # quantile bins per numeric feature (edges taken from the training data)
+PSI_THRESHOLD = 0.2      # PSI above 0.2 is the usual "significant shift" rule of thumb
+MIN_SAMPLES = 100        # do not raise alerts before this many scored requests
+FLUSH_EVERY = 50         # flush local counts to the shared state after this many updates...
+FLUSH_SECONDS = 30       # ...or after this many seconds, whichever comes first
+EPSILON = 1e-4           # floor for empty bins so PSI stays finite
+
+
+def build_baseline(csv_path):
+    """
+    Builds the training-data baseline the live traffic is compared against.
+
+    Numeric features are split into quantile bins using edges taken from the training data, so every
+    bin holds roughly the same share of training rows. Categorical features keep one bucket per known
+    category plus an 'other' bucket. Both layouts have a fixed size, which is what keeps the live
+    sketches bounded.
+
+    Args:
+    csv_path (str): Path to the training dataset.
+
+    Returns:
+    dict: Per-feature bin layout ('edges' or 'categories') and the training proportion of each bin.
+    """
+    data = pd.read_csv(csv_path, skipinitialspace=True)
+    data.columns = data.columns.str.strip()
+
+    baseline = {}
+    for feature in NUMERIC_FEATURES:
+        values = data[feature].astype(float).to_numpy()
+        quantiles = np.quantile(values, np.linspace(0, 1, NUM_BINS + 1)[1:-1])
+        edges = sorted(set(float(q) for q in quantiles))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        baseline[feature] = {'edges': edges, 'expected': (counts / counts.sum()).tolist()}
+
+    for feature in CATEGORICAL_FEATURES:
+        codes = CATEGORY_CODES[feature]
+        labels = data[feature].astype(str).str.strip()
+        categories = sorted(codes.values()) + [OTHER]
+        mapped = labels.map(codes).fillna(OTHER)
+        counts = mapped.value_counts()
+        expected = [float(counts.get(c, 0)) / len(mapped) for c in categories]
+        baseline[feature] = {'categories': categories, 'expected': expected}
+
+    return baseline
+
+
+def _empty_counts(baseline):
+    """Returns a zeroed count vector per feature, plus a slot for unparseable values."""
+    return {feature: [0] * (len(spec['expected']) + 1) for feature, spec in baseline.items()}
+
+
+def psi(expected, actual):
+    """
+    Computes the Population Stability Index between two binned distributions.
+
+    Args:
+    expected (list): Baseline proportion of each bin.
+    actual (list): Live proportion of each bin.
+
+    Returns:
+    float: The PSI score; 0 means identical distributions.
+    """
+    e = np.clip(np.asarray(expected, dtype=float), EPSILON, None)
+    a = np.clip(np.asarray(actual, dtype=float), EPSILON, None)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def ks(expected, actual):
+    """
+    Computes the Kolmogorov-Smirnov statistic between two binned distributions.
+
+    Because both sides are binned on the same edges this is the KS distance evaluated at the bin
+    edges, a close lower bound of the exact statistic.
+
+    Args:
+    expected (list): Baseline proportion of each bin.
+    actual (list): Live proportion of each bin.
+
+    Returns:
+    float: The largest gap between the two cumulative distributions.
+    """
+    return float(np.max(np.abs(np.cumsum(expected) - np.cumsum(actual))))
+
+
+class DriftMonitor:
+    """
+    Streaming monitor comparing scored applications with the training distribution.
+
+    Every call to 'update' adds the request to fixed-size per-feature histograms, so memory does not
+    grow with traffic. Each worker process keeps a local delta and periodically folds it into a small
+    JSON state file shared by all gunicorn workers (guarded by a file lock and replaced atomically),
+    which is how counts are merged across processes. The state file belongs to one deployment, so
+    every deployment starts from a clean slate.
+    """
+
+    def __init__(self, baseline, state_path=None):
+        """
+        Args:
+        baseline (dict): Training-data baseline, as returned by 'build_baseline'.
+        state_path (str): Shared state file. Defaults to one keyed by the gunicorn master pid.
+        """
+        self.baseline = baseline
+        if state_path is None:
+            state_path = deployment_path('drift.json', os.getppid())
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._delta = _empty_counts(baseline)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def _bin(self, feature, value):
+        """Returns the bin index of a raw form value; the last index is reserved for invalid values."""
+        spec = self.baseline[feature]
+        if 'edges' in spec:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return len(spec['expected'])
+            if number != number:  # NaN
+                return len(spec['expected'])
+            return bisect.bisect_right(spec['edges'], number)
+        categories = spec['categories']
+        value = str(value).strip()
+        return categories.index(value) if value in categories else categories.index(OTHER)
+
+    def update(self, row):
+        """
+        Records one scored application.
+
+        Args:
+        row (dict): Raw form values keyed by feature name.
+        """
+        with self._lock:
+            for feature in self.baseline:
+                self._delta[feature][self._bin(feature, row.get(feature))] += 1
+            self._pending += 1
+            due = (self._pending >= FLUSH_EVERY or
+                   time.monotonic() - self._last_flush >= FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def _empty_state(self):
+        return {'counts': _empty_counts(self.baseline), 'alerting': False}
+
+    def flush(self):
+        """
+        Folds this worker's local counts into the shared state and checks the alert threshold.
+
+        The alert flag lives in the shared state too, so a threshold crossing is logged once by the
+        worker whose flush crossed it rather than once per worker.
+
+        Returns:
+        dict: The drift report over the merged counts of all workers, or None if the shared state
+        could not be updated.
+        """
+        with self._lock:
+            delta = self._delta
+            self._delta = _empty_counts(self.baseline)
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+        def merge(state):
+            totals = state.setdefault('counts', {})
+            for feature, counts in delta.items():
+                stored = totals.get(feature)
+                if stored is None or len(stored) != len(counts):
+                    stored = [0] * len(counts)
+                totals[feature] = [s + c for s, c in zip(stored, counts)]
+            report = self._scores(totals)
+            crossed = report['alert'] != state.get('alerting', False)
+            state['alerting'] = report['alert']
+            return report, crossed
+
+        try:
+            if not any(any(counts) for counts in delta.values()):
+                state = read_state(self.state_path, self._empty_state)
+                return self._scores(state.get('counts', {}))
+            _, (report, crossed) = update_state(self.state_path, merge, self._empty_state)
+        except OSError:
+            logger.exception("Could not update drift state at %s", self.state_path)
+            # Keep the counts so they are retried on the next flush
+            with self._lock:
+                for feature, counts in delta.items():
+                    self._delta[feature] = [a + b for a, b in zip(self._delta[feature], counts)]
+            return None
+        if crossed:
+            self._log_alert(report)
+        return report
+
+    def _scores(self, totals):
+        """Computes PSI and KS per feature from merged counts."""
+        features = {}
+        samples = 0
+        for feature, spec in self.baseline.items():
+            counts = totals.get(feature) or [0] * (len(spec['expected']) + 1)
+            valid = counts[:-1]
+            total = sum(valid)
+            samples = max(samples, sum(counts))
+            entry = {'count': total, 'invalid': counts[-1], 'psi': None, 'ks': None}
+            if total:
+                actual = [c / total for c in valid]
+                entry['psi'] = psi(spec['expected'], actual)
+                entry['ks'] = ks(spec['expected'], actual)
+            features[feature] = entry
+
+        drifted = sorted(f for f, e in features.items() if e['psi'] is not None and e['psi'] > PSI_THRESHOLD)
+        return {
+            'samples': samples,
+            'psi_threshold': PSI_THRESHOLD,
+            'alert': samples >= MIN_SAMPLES and bool(drifted),
+            'drifted_features': drifted,
+            'features': features,
+        }
+
+    def _log_alert(self, report):
+        """Logs a warning when drift crosses the threshold, and once more when it recovers."""
+        if report['alert']:
+            logger.warning("Input drift detected on %s after %d requests (PSI > %.2f)",
+                           ', '.join(report['drifted_features']), report['samples'], PSI_THRESHOLD)
+        else:
+            logger.warning("Input drift back under threshold after %d requests", report['samples'])
+
+    def report(self):
+        """
+        Returns the current drift scores across all workers.
+
+        Returns:
+        dict: Sample count, alert flag, drifted features and per-feature PSI/KS scores.
+        """
+        report = self.flush()
+        if report is None:
+            with self._lock:
+                report = self._scores({feature: list(counts) for feature, counts in self._delta.items()})
+        return report
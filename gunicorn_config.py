@@ -0,0 +1,8 @@
+import os
+
+
+# Gunicorn settings, loaded with 'gunicorn app:app --config gunicorn_config.py' (see Procfile).
+# app.py sizes admission control from 'workers' and 'threads', so change them here only.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = 8
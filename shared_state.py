@@ -0,0 +1,139 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev server: single process, a thread lock is enough
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+_thread_lock = threading.Lock()
+
+
+def pid_alive(pid):
+    """Returns whether a process with this pid is still running."""
+    if os.name == 'nt':  # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def deployment_path(name, owner_pid):
+    """
+    Returns the temp path of a piece of state shared by the processes of one deployment.
+
+    The path is keyed by 'owner_pid', the process that lives exactly as long as the deployment (the
+    gunicorn master, or the dev server itself). State left behind by owners that are no longer running
+    is removed, so old deployments neither leak into new ones nor pile up in the temp directory.
+
+    Args:
+    name (str): Name of the state, e.g. 'drift.json'.
+    owner_pid (int): Pid of the process owning the deployment.
+
+    Returns:
+    str: The path to use for this deployment.
+    """
+    stem, ext = os.path.splitext(name)
+    prefix = os.path.join(tempfile.gettempdir(), 'ua_innovate_{}_'.format(stem))
+    for stale in glob.glob(prefix + '*' + ext):
+        pid = stale[len(prefix):len(stale) - len(ext)]
+        if pid.isdigit() and int(pid) != owner_pid and not pid_alive(int(pid)):
+            if os.path.isdir(stale):
+                shutil.rmtree(stale, ignore_errors=True)
+            else:
+                for leftover in (stale, stale + '.lock'):
+                    with contextlib.suppress(OSError):
+                        os.remove(leftover)
+    return '{}{}{}'.format(prefix, owner_pid, ext)
+
+
+@contextlib.contextmanager
+def locked(path, shared=False):
+    """Holds a lock on a JSON state file, taken on a sibling '.lock' file so the data can be replaced."""
+    with _thread_lock if not shared else contextlib.nullcontext():
+        if fcntl is None:
+            yield
+            return
+        with open(path + '.lock', 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _load(path, default):
+    """Reads a JSON state file; a missing file yields 'default()', an unreadable one raises ValueError."""
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return default()
+
+
+def read_state(path, default):
+    """
+    Reads a JSON state file shared between workers.
+
+    An unreadable file reads as 'default()'; it is left for the next 'update_state' to reset, so
+    read-only callers such as monitoring endpoints never log or write.
+
+    Args:
+    path (str): Path of the state file.
+    default (callable): Returns the initial state when the file is missing or unreadable.
+
+    Returns:
+    The decoded state.
+    """
+    with locked(path, shared=True):
+        try:
+            return _load(path, default)
+        except ValueError:
+            return default()
+
+
+def update_state(path, update, default):
+    """
+    Applies 'update' to a JSON state file shared between workers.
+
+    The new state is written to a temp file and moved into place with 'os.replace', so a worker killed
+    mid-write can never leave a truncated file behind. An unreadable file is reset to 'default()'.
+
+    Args:
+    path (str): Path of the state file.
+    update (callable): Modifies the decoded state in place; its return value is passed through.
+    default (callable): Returns the initial state when the file is missing or unreadable.
+
+    Returns:
+    tuple: The new state and the return value of 'update'.
+    """
+    with locked(path):
+        try:
+            state = _load(path, default)
+        except ValueError:
+            logger.warning("Resetting unreadable state file %s", path)
+            state = default()
+        result = update(state)
+        handle = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False, suffix='.tmp')
+        try:
+            with handle:
+                json.dump(state, handle)
+            os.replace(handle.name, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(handle.name)
+            raise
+    return state, result
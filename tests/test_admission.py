@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Limit, Pool
+
+
+class UpstreamTimeout(Exception):
+    pass
+
+
+def _controller(state_dir, budget=4, per_process=4, concurrency=1, queue=1, deadline=0.3):
+    return AdmissionController(
+        classes={'llm': Pool(budget=budget, per_process=per_process)},
+        routes={
+            'a': ('llm', Limit(concurrency=concurrency, queue=queue, deadline=deadline)),
+            'b': ('llm', Limit(concurrency=concurrency, queue=queue, deadline=deadline)),
+        },
+        state_dir=str(state_dir),
+        upstream_errors=(UpstreamTimeout,))
+
+
+def _route(controller, route):
+    return controller.stats()['routes'][route]
+
+
+def test_unregistered_routes_are_always_admitted(tmp_path):
+    controller = _controller(tmp_path, budget=1, per_process=1)
+    held = controller.acquire('a')
+
+    assert held is not None
+    assert controller.acquire('index') is not None
+    held.release()
+
+
+def test_shed_when_process_pool_is_full(tmp_path):
+    controller = _controller(tmp_path, budget=4, per_process=1)
+    held = controller.acquire('a')
+
+    assert controller.acquire('b') is None
+    assert _route(controller, 'b')['shed_class_full'] == 1
+    held.release()
+    assert controller.acquire('b') is not None
+
+
+def _hold_slot(state_dir, started, stop):
+    ticket = _controller(state_dir, budget=1).acquire('a')
+    started.set()
+    stop.wait(5)
+    ticket.release()
+
+
+def test_shed_when_shared_budget_is_full(tmp_path):
+    started, stop = multiprocessing.Event(), multiprocessing.Event()
+    worker = multiprocessing.Process(target=_hold_slot, args=(str(tmp_path), started, stop))
+    worker.start()
+    try:
+        assert started.wait(5)
+        controller = _controller(tmp_path, budget=1)
+        assert controller.acquire('b') is None
+        assert _route(controller, 'b')['shed_class_full'] == 1
+    finally:
+        stop.set()
+        worker.join()
+
+
+def test_queue_full_and_deadline(tmp_path):
+    controller = _controller(tmp_path, queue=1, deadline=0.3)
+    running = controller.acquire('a')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(controller.acquire('a')))
+    waiter.start()
+    time.sleep(0.1)
+
+    assert _route(controller, 'a')['queued'] == 1
+    assert controller.acquire('a') is None
+    waiter.join()
+
+    stats = _route(controller, 'a')
+    assert results == [None]
+    assert (stats['shed_queue_full'], stats['shed_deadline'], stats['queued']) == (1, 1, 0)
+    running.release()
+
+
+def test_queued_request_gets_freed_slot(tmp_path):
+    controller = _controller(tmp_path, queue=1, deadline=2)
+    running = controller.acquire('a')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(controller.acquire('a')))
+    waiter.start()
+    time.sleep(0.1)
+    running.release()
+    waiter.join()
+
+    assert results[0] is not None
+    stats = _route(controller, 'a')
+    assert (stats['admitted'], stats['in_flight'], stats['queued']) == (2, 1, 0)
+    results[0].release()
+
+
+def test_new_arrivals_queue_behind_waiters(tmp_path):
+    controller = _controller(tmp_path, queue=1, deadline=1)
+    running = controller.acquire('a')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(controller.acquire('a')))
+    waiter.start()
+    time.sleep(0.1)
+
+    running.release()
+    # The slot is free but a request is already waiting for it, and the only queue place is taken
+    assert controller.acquire('a') is None
+    waiter.join()
+    assert results[0] is not None
+    results[0].release()
+
+
+def test_slots_released_when_view_raises(tmp_path):
+    controller = _controller(tmp_path, per_process=1)
+
+    @controller.limit('a', degraded=lambda: 'busy')
+    def view():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        view()
+    stats = controller.stats()
+    assert stats['classes']['llm']['in_flight'] == 0
+    ticket = controller.acquire('a')
+    assert ticket is not None
+    ticket.release()
+
+
+def test_upstream_error_returns_degraded_response(tmp_path):
+    controller = _controller(tmp_path, per_process=1)
+
+    @controller.limit('a', degraded=lambda: 'busy')
+    def view():
+        raise UpstreamTimeout()
+
+    assert view() == 'busy'
+    assert _route(controller, 'a')['upstream_errors'] == 1
+    ticket = controller.acquire('a')
+    assert ticket is not None
+    ticket.release()
+
+
+def _acquire_and_die(state_dir):
+    _controller(state_dir).acquire('a')
+    os._exit(0)
+
+
+def test_gauges_of_dead_workers_are_pruned(tmp_path):
+    worker = multiprocessing.Process(target=_acquire_and_die, args=(str(tmp_path),))
+    worker.start()
+    worker.join()
+    controller = _controller(tmp_path)
+
+    stats = _route(controller, 'a')
+    assert (stats['admitted'], stats['in_flight']) == (1, 0)
+    # The dead worker's slot was released by the kernel along with its lock file handle
+    ticket = controller.acquire('a')
+    assert ticket is not None
+    ticket.release()
+
+
+def test_stats_polling_does_not_shed(tmp_path):
+    controller = _controller(tmp_path, per_process=8, budget=8, concurrency=2, queue=0)
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            controller.stats()
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    try:
+        for _ in range(50):
+            ticket = controller.acquire('a')
+            assert ticket is not None
+            ticket.release()
+    finally:
+        stop.set()
+        poller.join()
+    assert _route(controller, 'a')['shed_queue_full'] == 0
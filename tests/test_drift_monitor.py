@@ -0,0 +1,97 @@
+import logging
+import multiprocessing
+
+import pytest
+
+import drift_monitor
+from drift_monitor import DriftMonitor, build_baseline, ks, psi
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    return build_baseline('loan_approval_dataset.csv')
+
+
+def _training_rows(count):
+    """Rows spread across the training bins, coded the way the '/chat_predict' form posts them."""
+    data = drift_monitor.pd.read_csv('loan_approval_dataset.csv', skipinitialspace=True)
+    data['education'] = data['education'].map(drift_monitor.CATEGORY_CODES['education'])
+    data['employment'] = data['employment'].map(drift_monitor.CATEGORY_CODES['employment'])
+    return data.sample(count, random_state=0).to_dict('records')
+
+
+def _drifted_row():
+    return {'score': '850', 'education': '0', 'employment': '1', 'income': 'n/a'}
+
+
+def test_baseline_bins_are_fixed_size(baseline):
+    assert set(baseline) == set(drift_monitor.NUMERIC_FEATURES + drift_monitor.CATEGORICAL_FEATURES)
+    for spec in baseline.values():
+        assert sum(spec['expected']) == pytest.approx(1)
+    assert len(baseline['score']['expected']) == drift_monitor.NUM_BINS
+    assert baseline['education']['categories'] == ['0', '1', drift_monitor.OTHER]
+
+
+def test_scores_of_identical_distributions_are_zero():
+    assert psi([0.5, 0.5], [0.5, 0.5]) == pytest.approx(0)
+    assert ks([0.5, 0.5], [0.5, 0.5]) == pytest.approx(0)
+    assert psi([0.5, 0.5], [0.9, 0.1]) > drift_monitor.PSI_THRESHOLD
+    assert ks([0.5, 0.5], [0.9, 0.1]) == pytest.approx(0.4)
+
+
+def test_training_traffic_does_not_alert(baseline, tmp_path):
+    monitor = DriftMonitor(baseline, state_path=str(tmp_path / 'drift.json'))
+    for row in _training_rows(300):
+        monitor.update(row)
+
+    report = monitor.report()
+    assert report['samples'] == 300
+    assert not report['alert']
+
+
+def test_drifted_traffic_alerts_and_counts_invalid_values(baseline, tmp_path):
+    monitor = DriftMonitor(baseline, state_path=str(tmp_path / 'drift.json'))
+    for _ in range(drift_monitor.MIN_SAMPLES):
+        monitor.update(_drifted_row())
+
+    report = monitor.report()
+    assert report['alert']
+    assert 'score' in report['drifted_features']
+    assert report['features']['income'] == {'count': 0, 'invalid': drift_monitor.MIN_SAMPLES, 'psi': None, 'ks': None}
+
+
+def _feed(baseline, path):
+    monitor = DriftMonitor(baseline, state_path=path)
+    for _ in range(drift_monitor.MIN_SAMPLES):
+        monitor.update(_drifted_row())
+    monitor.flush()
+
+
+def test_counts_merge_across_processes_and_alert_is_logged_once(baseline, tmp_path, caplog):
+    path = str(tmp_path / 'drift.json')
+    workers = [multiprocessing.Process(target=_feed, args=(baseline, path)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    monitor = DriftMonitor(baseline, state_path=path)
+    with caplog.at_level(logging.WARNING, logger='drift_monitor'):
+        report = monitor.report()
+        for _ in range(drift_monitor.FLUSH_EVERY):
+            monitor.update(_drifted_row())
+
+    assert report['samples'] == 3 * drift_monitor.MIN_SAMPLES
+    assert report['alert']
+    # The alert was raised by one of the workers; the shared flag keeps this process from repeating it
+    assert caplog.records == []
+
+
+def test_truncated_state_is_reset(baseline, tmp_path):
+    path = tmp_path / 'drift.json'
+    path.write_text('{"counts": {"sco')
+    monitor = DriftMonitor(baseline, state_path=str(path))
+
+    assert monitor.report()['samples'] == 0
+    monitor.update(_drifted_row())
+    assert monitor.flush()['samples'] == 1
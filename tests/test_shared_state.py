@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+
+from shared_state import deployment_path, read_state, update_state
+
+
+def _empty():
+    return {'count': 0}
+
+
+def _bump(state):
+    state['count'] += 1
+    return state['count']
+
+
+def test_update_state_creates_and_updates(tmp_path):
+    path = str(tmp_path / 'state.json')
+
+    assert update_state(path, _bump, _empty) == ({'count': 1}, 1)
+    assert update_state(path, _bump, _empty) == ({'count': 2}, 2)
+    assert read_state(path, _empty) == {'count': 2}
+
+
+def test_update_state_leaves_no_temp_files(tmp_path):
+    path = str(tmp_path / 'state.json')
+    update_state(path, _bump, _empty)
+
+    assert sorted(os.listdir(tmp_path)) == ['state.json', 'state.json.lock']
+
+
+def test_update_state_recovers_from_truncated_file(tmp_path, caplog):
+    path = str(tmp_path / 'state.json')
+    with open(path, 'w') as handle:
+        handle.write('{"cou')
+
+    with caplog.at_level(logging.WARNING, logger='shared_state'):
+        state, _ = update_state(path, _bump, _empty)
+        update_state(path, _bump, _empty)
+
+    assert state == {'count': 1}
+    with open(path) as handle:
+        assert json.load(handle) == {'count': 2}
+    assert len([r for r in caplog.records if 'Resetting' in r.getMessage()]) == 1
+
+
+def test_read_state_on_truncated_file_is_quiet(tmp_path, caplog):
+    path = str(tmp_path / 'state.json')
+    with open(path, 'w') as handle:
+        handle.write('{"cou')
+
+    with caplog.at_level(logging.WARNING, logger='shared_state'):
+        assert read_state(path, _empty) == {'count': 0}
+        assert read_state(path, _empty) == {'count': 0}
+
+    assert caplog.records == []
+
+
+def test_deployment_path_removes_state_of_dead_owners(tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+    monkeypatch.setattr('shared_state.pid_alive', lambda pid: pid == 111)
+    for pid in (111, 222):
+        (tmp_path / 'ua_innovate_drift_{}.json'.format(pid)).write_text('{}')
+        (tmp_path / 'ua_innovate_drift_{}.json.lock'.format(pid)).write_text('')
+    (tmp_path / 'ua_innovate_admission_222').mkdir()
+
+    path = deployment_path('drift.json', 333)
+    deployment_path('admission', 333)
+
+    assert path == str(tmp_path / 'ua_innovate_drift_333.json')
+    assert sorted(os.listdir(tmp_path)) == ['ua_innovate_drift_111.json', 'ua_innovate_drift_111.json.lock']